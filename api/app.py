@@ -6,29 +6,56 @@ import platform
 import base64
 import json
 import mimetypes
-import uuid
+import secrets
 import shutil
+import hashlib
+import errno
+import sqlite3
+import time
+import threading
+import re
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 from pathlib import Path
-from flask import Flask, jsonify, request, send_file, after_this_request
+from flask import Flask, jsonify, request, send_file, send_from_directory, make_response
 from flask_restful import Api, Resource
 from flask_cors import CORS, cross_origin
+from werkzeug.utils import secure_filename
+from scad_parallel import split_union_children, merge_binary_stls
 import sys
 
+try:
+    import fcntl
+except ImportError:
+    # Windows has no flock; renders are then only limited within each process
+    fcntl = None
+
 # Initialize Flask application with RESTful API and CORS support
 app = Flask(__name__)
 api = Api(app)
 CORS(app)
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Cap request bodies so oversized SCAD pastes or uploads are rejected before parsing
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 4 * 1024 * 1024))
+
+# Configure logging; per-request details are logged at DEBUG, set LOG_LEVEL=DEBUG to see them
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
+
+# Resolve the OpenSCAD executable once, preferring one on PATH and falling back
+# to the platform default location
+OPENSCAD_PATH = shutil.which('openscad')
+if OPENSCAD_PATH is None:
+    if platform.system() == 'Windows':
+        # On Windows, use the Windows executable
+        OPENSCAD_PATH = './bin/openscad.exe'
+    else:
+        # In Docker (Linux), use the installed OpenSCAD from the container
+        OPENSCAD_PATH = '/usr/local/bin/openscad'
 
-# Set the OpenSCAD path based on the platform
-if platform.system() == 'Windows':
-    # On Windows, use the Windows executable
-    OPENSCAD_PATH = './bin/openscad.exe'
-else:
-    # In Docker (Linux), use the installed OpenSCAD from the container
-    OPENSCAD_PATH = '/usr/local/bin/openscad'
+# Fail at startup rather than on every render request
+if not os.path.exists(OPENSCAD_PATH):
+    raise RuntimeError(f"OpenSCAD executable not found at {OPENSCAD_PATH}. Ensure it is installed and in the system's PATH.")
 
 # Log the selected OpenSCAD path
 logging.info(f"Using OpenSCAD at: {OPENSCAD_PATH}")
@@ -38,13 +65,400 @@ MODELS_DIR = os.path.join(tempfile.gettempdir(), 'openscad_models')
 os.makedirs(MODELS_DIR, exist_ok=True)
 logging.info(f"Using models directory: {MODELS_DIR}")
 
+# Scratch space for in-progress renders; prefer tmpfs so intermediate files never hit disk
+WORK_DIR = os.environ.get('OPENSCAD_WORK_DIR') or (
+    '/dev/shm/openscad_work' if os.path.isdir('/dev/shm') else os.path.join(MODELS_DIR, 'work')
+)
+os.makedirs(WORK_DIR, exist_ok=True)
+logging.info(f"Using work directory: {WORK_DIR}")
+
+# When set (e.g. "/models/"), View3D hands STL delivery to nginx via X-Accel-Redirect;
+# the prefix must map to MODELS_DIR through an internal nginx location
+STL_ACCEL_REDIRECT_PREFIX = os.environ.get('STL_ACCEL_REDIRECT_PREFIX')
+
 # Set up libraries directory for OpenSCAD includes
 LIBRARIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'libraries')
 os.makedirs(LIBRARIES_DIR, exist_ok=True)
 logging.info(f"Using libraries directory: {LIBRARIES_DIR}")
 
-# Store rendered STL file paths
-stl_cache = {}
+# Let OpenSCAD resolve include/use statements straight from the libraries directory
+OPENSCAD_ENV = dict(os.environ)
+OPENSCAD_ENV['OPENSCADPATH'] = os.pathsep.join(
+    path for path in (LIBRARIES_DIR, os.environ.get('OPENSCADPATH')) if path
+)
+
+# Cached listing of library files, invalidated by uploads
+_LIB_CACHE = {'files': None, 'mtime': None}
+
+def _library_files():
+    """Return (name, size, mtime) for each .scad library, re-listing only when the directory changes."""
+    # Uploads replace files atomically, so the directory mtime also catches
+    # uploads handled by other worker processes
+    dir_mtime = os.stat(LIBRARIES_DIR).st_mtime_ns
+    if _LIB_CACHE['files'] is None or _LIB_CACHE['mtime'] != dir_mtime:
+        files = []
+        for lib_file in sorted(os.listdir(LIBRARIES_DIR)):
+            if lib_file.endswith('.scad'):
+                stat = os.stat(os.path.join(LIBRARIES_DIR, lib_file))
+                files.append((lib_file, stat.st_size, stat.st_mtime_ns))
+        _LIB_CACHE['files'] = files
+        _LIB_CACHE['mtime'] = dir_mtime
+    return _LIB_CACHE['files']
+
+def _model_id(scad_bytes, variant=b''):
+    """Hash UTF-8 SCAD source and the library listing so library uploads invalidate earlier renders."""
+    # The variant personalises the hash so differently produced STLs never share an id
+    digest = hashlib.blake2b(scad_bytes, digest_size=16, person=variant)
+    for lib_file, size, mtime in _library_files():
+        digest.update(f"\0{lib_file}\0{size}\0{mtime}".encode('utf-8'))
+    return digest.hexdigest()
+
+def _write_scad_file(scad_file_path, scad_bytes):
+    """Write UTF-8 SCAD source straight to a file descriptor, skipping the buffered file layer."""
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+    fd = os.open(scad_file_path, flags, 0o644)
+    try:
+        remaining = memoryview(scad_bytes)
+        while remaining:
+            remaining = remaining[os.write(fd, remaining):]
+    finally:
+        os.close(fd)
+
+def _publish(src_path, dst_path):
+    """Atomically move a finished file into place, copying when it crosses filesystems."""
+    try:
+        os.replace(src_path, dst_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # WORK_DIR and MODELS_DIR live on different filesystems; copy next to the
+        # destination first so the final rename is still atomic
+        tmp_dst_path = f"{dst_path}.{secrets.token_hex(16)}.tmp"
+        shutil.copy2(src_path, tmp_dst_path)
+        os.replace(tmp_dst_path, dst_path)
+
+# Maximum number of rendered models kept before the least recently used is deleted
+CACHE_MAX = int(os.environ.get("STL_CACHE_MAX", 256))
+logging.info(f"Keeping at most {CACHE_MAX} rendered models")
+
+# Persistent index of rendered models shared by every worker process. It maps STL
+# names to paths, so lookups never walk MODELS_DIR, and records when each model
+# was last used, so all workers evict from the same least-recently-used order
+INDEX_DB_PATH = os.path.join(MODELS_DIR, 'index.db')
+index_db = sqlite3.connect(INDEX_DB_PATH, timeout=30, check_same_thread=False)
+index_db.execute("CREATE TABLE IF NOT EXISTS models (name TEXT PRIMARY KEY, path TEXT, last_access REAL)")
+index_db.execute("CREATE INDEX IF NOT EXISTS models_last_access ON models (last_access)")
+index_db.commit()
+index_db_lock = threading.Lock()
+
+# Only record a new access time once the previous one is this many seconds old,
+# so repeated views of the same model don't write to the index on every request
+ACCESS_RESOLUTION = 60
+
+# Model ids are 128-bit hex digests, so every model STL is named <32 hex digits>.stl
+_MODEL_STL_NAME = re.compile(r'[0-9a-f]{32}\.stl')
+
+def _model_stl_path(model_id):
+    """Return where the STL for a model id lives: MODELS_DIR/<model_id>/<model_id>.stl."""
+    return os.path.join(MODELS_DIR, model_id, f"{model_id}.stl")
+
+def _is_model_stl_path(stl_file_path):
+    """Return True if a path has the MODELS_DIR/<model_id>/<model_id>.stl layout."""
+    stl_basename = os.path.basename(stl_file_path)
+    model_dir = os.path.dirname(os.path.abspath(stl_file_path))
+    return (bool(_MODEL_STL_NAME.fullmatch(stl_basename))
+            and os.path.basename(model_dir) == stl_basename[:-len('.stl')]
+            and os.path.dirname(model_dir) == os.path.abspath(MODELS_DIR))
+
+def _remove_model(stl_file_path):
+    """Delete an evicted model, removing its directory only when it is a model directory."""
+    if _is_model_stl_path(stl_file_path):
+        shutil.rmtree(os.path.dirname(stl_file_path), ignore_errors=True)
+    else:
+        # Never rmtree anything else, in particular MODELS_DIR itself
+        try:
+            os.remove(stl_file_path)
+        except OSError:
+            pass
+
+def _evict_models():
+    """Delete the least recently used models beyond CACHE_MAX across all workers."""
+    with index_db_lock, index_db:
+        # Take the write lock up front so concurrent evictions don't pick the same rows
+        index_db.execute("BEGIN IMMEDIATE")
+        evicted = index_db.execute(
+            "SELECT name, path FROM models ORDER BY last_access DESC LIMIT -1 OFFSET ?",
+            (CACHE_MAX,)
+        ).fetchall()
+        index_db.executemany("DELETE FROM models WHERE name = ?", [(name,) for name, path in evicted])
+    
+    # Delete evicted model directories outside the lock
+    for old_basename, old_path in evicted:
+        logging.debug("Evicting cached model: %s", old_basename)
+        _remove_model(old_path)
+
+def _index_rebuild():
+    """Add the model directories in MODELS_DIR to the index and drop rows for deleted models."""
+    rows = []
+    # Only MODELS_DIR/<model_id>/<model_id>.stl files are models; anything else
+    # (stray files, the work directory, index.db) is left out of the index
+    for entry in os.scandir(MODELS_DIR):
+        if entry.is_dir() and _MODEL_STL_NAME.fullmatch(f"{entry.name}.stl"):
+            path = _model_stl_path(entry.name)
+            if os.path.isfile(path):
+                rows.append((os.path.basename(path), path, os.path.getmtime(path)))
+    with index_db_lock, index_db:
+        # Keep access times already recorded by other workers; new rows start at the file mtime
+        index_db.executemany(
+            "INSERT INTO models VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE SET path = excluded.path",
+            rows
+        )
+        missing = [
+            (name,) for name, path in index_db.execute("SELECT name, path FROM models")
+            if not os.path.exists(path)
+        ]
+        index_db.executemany("DELETE FROM models WHERE name = ?", missing)
+    logging.info(f"Indexed {len(rows)} existing STL files")
+    
+    # Models left over from earlier runs count towards CACHE_MAX too
+    _evict_models()
+
+def _cache_put(stl_basename, stl_file_path):
+    """Record a model as just used and evict the least recently used models beyond CACHE_MAX."""
+    with index_db_lock, index_db:
+        index_db.execute(
+            "INSERT INTO models VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET path = excluded.path, last_access = excluded.last_access",
+            (stl_basename, stl_file_path, time.time())
+        )
+    _evict_models()
+
+def _cache_get(stl_basename):
+    """Return the indexed path for an STL and mark it as recently used, or None."""
+    now = time.time()
+    with index_db_lock:
+        row = index_db.execute(
+            "SELECT path, last_access FROM models WHERE name = ?", (stl_basename,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] < now - ACCESS_RESOLUTION:
+            with index_db:
+                index_db.execute("UPDATE models SET last_access = ? WHERE name = ?", (now, stl_basename))
+    return row[0]
+
+_index_rebuild()
+
+# Maximum number of OpenSCAD processes running at once across all worker processes
+# on this host; each render holds an flock on one of the slot files in WORK_DIR
+RENDER_CONCURRENCY = int(os.environ.get("RENDER_CONCURRENCY", os.cpu_count() or 2))
+render_semaphore = threading.BoundedSemaphore(RENDER_CONCURRENCY)
+RENDER_SLOT_PATHS = [os.path.join(WORK_DIR, f"render-slot-{i}.lock") for i in range(RENDER_CONCURRENCY)]
+
+# Seconds between attempts to grab a render slot held by other processes
+RENDER_SLOT_POLL = 0.1
+
+@contextlib.contextmanager
+def _render_slot():
+    """Hold one of RENDER_CONCURRENCY render slots shared by every process on the host."""
+    # The semaphore queues threads in this process; the slot files bound all processes
+    with render_semaphore:
+        if fcntl is None:
+            yield
+            return
+        while True:
+            for slot_path in RENDER_SLOT_PATHS:
+                fd = os.open(slot_path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(fd)
+                    continue
+                # The lock is released when the fd closes, even if the worker is killed
+                try:
+                    yield
+                finally:
+                    os.close(fd)
+                return
+            # flock would block the whole gevent worker, so poll with a cooperative sleep
+            time.sleep(RENDER_SLOT_POLL)
+
+# Seconds after which a runaway OpenSCAD render is killed
+RENDER_TIMEOUT = int(os.environ.get("RENDER_TIMEOUT", 300))
+logging.info(f"Running up to {RENDER_CONCURRENCY} renders at once with a {RENDER_TIMEOUT}s timeout")
+
+def _sweep_work_dir():
+    """Remove scratch directories left in WORK_DIR by workers killed mid-render."""
+    # Live renders in other workers finish well within this age, including time
+    # spent waiting for a render slot
+    cutoff = time.time() - max(2 * RENDER_TIMEOUT, 3600)
+    removed = 0
+    for entry in os.scandir(WORK_DIR):
+        try:
+            if entry.is_dir(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        except OSError:
+            # Another worker may be sweeping the same entry
+            continue
+    if removed:
+        logging.info(f"Removed {removed} stale render directories from {WORK_DIR}")
+
+_sweep_work_dir()
+
+def _run_openscad(scad_file_path, stl_file_path, export_format=None):
+    """Run OpenSCAD on one file, raising CalledProcessError or TimeoutExpired on failure."""
+    command = [OPENSCAD_PATH, '-o', stl_file_path]
+    if export_format:
+        command += ['--export-format', export_format]
+    command.append(scad_file_path)
+    
+    # Limit concurrent OpenSCAD processes; extra requests wait for a free slot
+    with _render_slot():
+        # Discard stdout progress output; stderr is kept for error diagnostics
+        result = subprocess.run(
+            command, 
+            check=True, 
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            timeout=RENDER_TIMEOUT,
+            env=OPENSCAD_ENV
+        )
+    logging.debug("OpenSCAD output: %s", result.stderr)
+
+def _render_children(children, work_dir, stl_file_path):
+    """Render each union child in its own OpenSCAD process and merge the results."""
+    child_paths = []
+    for index, child_code in enumerate(children):
+        child_scad_path = os.path.join(work_dir, f"child_{index}.scad")
+        _write_scad_file(child_scad_path, child_code.encode('utf-8'))
+        child_paths.append((child_scad_path, os.path.join(work_dir, f"child_{index}.stl")))
+    
+    logging.info(f"Rendering {len(children)} union children in parallel")
+    with ThreadPoolExecutor(max_workers=min(len(children), RENDER_CONCURRENCY)) as executor:
+        futures = [
+            executor.submit(_run_openscad, child_scad_path, child_stl_path, 'binstl')
+            for child_scad_path, child_stl_path in child_paths
+        ]
+        try:
+            for future in futures:
+                future.result()
+        except Exception:
+            # Don't start the remaining children once one has failed
+            executor.shutdown(cancel_futures=True)
+            raise
+    
+    merge_binary_stls([child_stl_path for _, child_stl_path in child_paths], stl_file_path)
+
+class RenderError(Exception):
+    """Raised when a render fails; carries the JSON error body and HTTP status to return."""
+    def __init__(self, body, status=500):
+        super().__init__(body.get("error"))
+        self.body = body
+        self.status = status
+
+def _scad_code_from_request():
+    """Return the scadCode string from the JSON request body, raising RenderError(400) if invalid."""
+    try:
+        scad_code = orjson.loads(request.get_data(cache=False))['scadCode']
+    except (orjson.JSONDecodeError, KeyError, TypeError):
+        scad_code = None
+    if not isinstance(scad_code, str):
+        raise RenderError({"error": "Invalid payload: expected JSON with a scadCode string"}, 400)
+    return scad_code
+
+def _render_scad(scad_code, parallel=False):
+    """
+    Render OpenSCAD code to an STL file, reusing an earlier render of identical code.
+    
+    With parallel=True, code whose only geometry is a top-level union() has each child
+    rendered in a separate OpenSCAD process and the results merged into a binary STL.
+    Any other code is rendered normally, as is a union whose children rendered but
+    could not be merged.
+    
+    Returns:
+    (model_id, stl_file_path) for the rendered model.
+    
+    Raises:
+    RenderError if OpenSCAD fails, times out or produces no STL file.
+    """
+    children = split_union_children(scad_code) if parallel else None
+    if children:
+        try:
+            return _render_model(scad_code, children)
+        except RenderError as e:
+            # A timeout or an OpenSCAD error in a child would only repeat in a single render
+            if isinstance(e.__cause__, (subprocess.TimeoutExpired, subprocess.CalledProcessError)):
+                raise
+            logging.warning(f"Parallel render failed, rendering as a single model: {e}")
+    return _render_model(scad_code)
+
+def _render_model(scad_code, children=None):
+    """Render scad_code, or its union children if given, and publish the STL under its model id."""
+    # Key the model by a hash of its source so identical code maps to the same STL
+    # Encode once; the same bytes are hashed and written to disk
+    scad_bytes = scad_code.encode('utf-8')
+    model_id = _model_id(scad_bytes, b'parallel' if children else b'')
+    model_dir = os.path.join(MODELS_DIR, model_id)
+    
+    scad_file_path = os.path.join(model_dir, f"{model_id}.scad")
+    stl_file_path = os.path.join(model_dir, f"{model_id}.stl")
+    stl_basename = os.path.basename(stl_file_path)
+    
+    # Reuse a previous render of the same code instead of running OpenSCAD again
+    if os.path.exists(stl_file_path):
+        logging.debug("Reusing cached STL file: %s", stl_file_path)
+        _cache_put(stl_basename, stl_file_path)
+        return model_id, stl_file_path
+    
+    # Render in a private scratch directory and publish the results once complete,
+    # so concurrent identical requests never observe a half-written STL
+    work_dir = os.path.join(WORK_DIR, secrets.token_hex(16))
+    os.makedirs(work_dir)
+    tmp_scad_file_path = os.path.join(work_dir, f"{model_id}.scad")
+    tmp_stl_file_path = os.path.join(work_dir, f"{model_id}.stl")
+    
+    # Write SCAD code to file
+    _write_scad_file(tmp_scad_file_path, scad_bytes)
+    
+    try:
+        # Run OpenSCAD to generate STL
+        logging.debug("Generating STL file at: %s", stl_file_path)
+        if children:
+            _render_children(children, work_dir, tmp_stl_file_path)
+        else:
+            _run_openscad(tmp_scad_file_path, tmp_stl_file_path)
+        
+        # Verify the STL file was created
+        if not os.path.exists(tmp_stl_file_path):
+            logging.error(f"STL file was not created at {tmp_stl_file_path}")
+            raise RenderError({"error": "Failed to generate STL file"})
+        
+        # Publish the finished render under its content-addressed name
+        os.makedirs(model_dir, exist_ok=True)
+        _publish(tmp_scad_file_path, scad_file_path)
+        _publish(tmp_stl_file_path, stl_file_path)
+        
+        # Store the file path in cache with the model_id as key
+        _cache_put(stl_basename, stl_file_path)
+        
+        logging.info(f"STL file created successfully: {stl_file_path}")
+        return model_id, stl_file_path
+    except RenderError:
+        raise
+    except subprocess.TimeoutExpired as e:
+        logging.error(f"OpenSCAD process timed out after {RENDER_TIMEOUT} seconds")
+        raise RenderError({"error": f"OpenSCAD render timed out after {RENDER_TIMEOUT} seconds"}, 504) from e
+    except subprocess.CalledProcessError as e:
+        logging.error(f"OpenSCAD process failed: {e.stderr}")
+        raise RenderError({"error": "OpenSCAD process failed", "details": e.stderr}) from e
+    except Exception as e:
+        logging.error(f"Unexpected error: {str(e)}")
+        raise RenderError({"error": f"Unexpected error: {str(e)}"})
+    finally:
+        # Remove the scratch directory along with anything a failed render left behind
+        shutil.rmtree(work_dir, ignore_errors=True)
 
 class HelloWorld(Resource):
     """API health check endpoint."""
@@ -68,62 +482,14 @@ class RenderScad(Resource):
             "stlPath": "/api/view3d?file=filename.stl"
         }
         """
-        data = request.get_json()
-        scad_code = data['scadCode']
-        
-        # Create unique filenames with UUID to avoid conflicts
-        model_id = str(uuid.uuid4())
-        model_dir = os.path.join(MODELS_DIR, model_id)
-        os.makedirs(model_dir, exist_ok=True)
-        
-        scad_file_path = os.path.join(model_dir, f"{model_id}.scad")
-        stl_file_path = os.path.join(model_dir, f"{model_id}.stl")
-        
-        # Copy all library files to the model directory so OpenSCAD can find them
-        for lib_file in os.listdir(LIBRARIES_DIR):
-            if lib_file.endswith('.scad'):
-                src_path = os.path.join(LIBRARIES_DIR, lib_file)
-                dst_path = os.path.join(model_dir, lib_file)
-                shutil.copy2(src_path, dst_path)
-                logging.info(f"Copied library file: {lib_file} to {dst_path}")
-        
-        # Write SCAD code to file
-        with open(scad_file_path, 'w', encoding='utf-8') as scad_file:
-            scad_file.write(scad_code)
-        
         try:
-            # Run OpenSCAD to generate STL
-            logging.info(f"Generating STL file at: {stl_file_path}")
-            result = subprocess.run(
-                [OPENSCAD_PATH, '-o', stl_file_path, scad_file_path], 
-                check=True, 
-                capture_output=True, 
-                text=True
-            )
-            logging.info(f"OpenSCAD output: {result.stdout}")
-            
-            # Store the file path in cache with the model_id as key
-            stl_basename = os.path.basename(stl_file_path)
-            stl_cache[stl_basename] = stl_file_path
-            
-            # Verify the STL file was created
-            if not os.path.exists(stl_file_path):
-                logging.error(f"STL file was not created at {stl_file_path}")
-                return {"error": "Failed to generate STL file"}, 500
-                
-            logging.info(f"STL file created successfully: {stl_file_path}")
-            
-            # Return the STL file path for 3D rendering with /api/ prefix
-            return {"stlPath": f"/api/view3d?file={stl_basename}"}
-        except FileNotFoundError:
-            logging.error("OpenSCAD executable not found. Ensure it is installed and in the system's PATH.")
-            return {"error": "OpenSCAD executable not found"}, 500
-        except subprocess.CalledProcessError as e:
-            logging.error(f"OpenSCAD process failed: {e.stderr}")
-            return {"error": "OpenSCAD process failed", "details": e.stderr}, 500
-        except Exception as e:
-            logging.error(f"Unexpected error: {str(e)}")
-            return {"error": f"Unexpected error: {str(e)}"}, 500
+            scad_code = _scad_code_from_request()
+            model_id, stl_file_path = _render_scad(scad_code)
+        except RenderError as e:
+            return e.body, e.status
+        
+        # Return the STL file path for 3D rendering with /api/ prefix
+        return {"stlPath": f"/api/view3d?file={os.path.basename(stl_file_path)}"}
 
 class GetStl(Resource):
     """Generates and provides an STL file for download."""
@@ -139,57 +505,43 @@ class GetStl(Resource):
         Returns:
         The STL file as an attachment for download.
         """
-        data = request.get_json()
-        scad_code = data['scadCode']
-        
-        # Create unique filenames with UUID to avoid conflicts
-        model_id = str(uuid.uuid4())
-        model_dir = os.path.join(MODELS_DIR, model_id)
-        os.makedirs(model_dir, exist_ok=True)
-        
-        scad_file_path = os.path.join(model_dir, f"{model_id}.scad")
-        stl_file_path = os.path.join(model_dir, f"{model_id}.stl")
-        
-        # Copy all library files to the model directory so OpenSCAD can find them
-        for lib_file in os.listdir(LIBRARIES_DIR):
-            if lib_file.endswith('.scad'):
-                src_path = os.path.join(LIBRARIES_DIR, lib_file)
-                dst_path = os.path.join(model_dir, lib_file)
-                shutil.copy2(src_path, dst_path)
-                logging.info(f"Copied library file: {lib_file} to {dst_path}")
-        
-        # Write SCAD code to file
-        with open(scad_file_path, 'w', encoding='utf-8') as scad_file:
-            scad_file.write(scad_code)
-        
         try:
-            # Run OpenSCAD to generate STL
-            result = subprocess.run(
-                [OPENSCAD_PATH, '-o', stl_file_path, scad_file_path], 
-                check=True, 
-                capture_output=True, 
-                text=True
-            )
-            logging.info(f"OpenSCAD output: {result.stdout}")
-            
-            # Verify the STL file was created
-            if not os.path.exists(stl_file_path):
-                logging.error(f"STL file was not created at {stl_file_path}")
-                return {"error": "Failed to generate STL file"}, 500
-        except FileNotFoundError:
-            logging.error("OpenSCAD executable not found. Ensure it is installed and in the system's PATH.")
-            return {"error": "OpenSCAD executable not found"}, 500
-        except subprocess.CalledProcessError as e:
-            logging.error(f"OpenSCAD process failed: {e.stderr}")
-            return {"error": "OpenSCAD process failed", "details": e.stderr}, 500
-        except Exception as e:
-            logging.error(f"Unexpected error: {str(e)}")
-            return {"error": f"Unexpected error: {str(e)}"}, 500
+            scad_code = _scad_code_from_request()
+            model_id, stl_file_path = _render_scad(scad_code)
+        except RenderError as e:
+            return e.body, e.status
         
         # Return the generated STL file
         return send_file(stl_file_path, mimetype='application/octet-stream', 
                          as_attachment=True, download_name='model.stl')
 
+class RenderParallel(Resource):
+    """Renders a top-level union() by rendering its children in parallel."""
+    def post(self):
+        """
+        Process OpenSCAD code to generate an STL file, rendering each child of a
+        top-level union() in its own OpenSCAD process. Intended for unions of
+        disjoint objects; other code falls back to a normal render.
+        
+        Expected JSON payload:
+        {
+            "scadCode": "... OpenSCAD code ..."
+        }
+        
+        Returns:
+        {
+            "stlPath": "/api/view3d?file=filename.stl"
+        }
+        """
+        try:
+            scad_code = _scad_code_from_request()
+            model_id, stl_file_path = _render_scad(scad_code, parallel=True)
+        except RenderError as e:
+            return e.body, e.status
+        
+        # Return the STL file path for 3D rendering with /api/ prefix
+        return {"stlPath": f"/api/view3d?file={os.path.basename(stl_file_path)}"}
+
 class View3D(Resource):
     """Serves STL files for viewing in the browser."""
     @cross_origin()
@@ -204,60 +556,48 @@ class View3D(Resource):
         The STL file with proper MIME type for rendering.
         """
         filename = request.args.get('file')
-        if not filename or not filename.endswith('.stl'):
+        # Only names of rendered models are served, so the name can never leave MODELS_DIR
+        if not filename or not _MODEL_STL_NAME.fullmatch(filename):
             logging.error(f"Invalid file parameter: {filename}")
             return {"error": "Invalid file parameter"}, 400
         
-        # Check if the file is in our cache
-        if filename in stl_cache:
-            stl_file_path = stl_cache[filename]
-            logging.info(f"File found in cache: {stl_file_path}")
-        else:
-            # Fallback to models directory if not in cache
-            # Look through all subdirectories in MODELS_DIR
-            for root, dirs, files in os.walk(MODELS_DIR):
-                if filename in files:
-                    stl_file_path = os.path.join(root, filename)
-                    logging.info(f"Found file in models subdirectory: {stl_file_path}")
-                    break
-            else:
-                stl_file_path = os.path.join(MODELS_DIR, filename)
-                logging.info(f"Looking for file in models directory: {stl_file_path}")
+        model_id = filename[:-len('.stl')]
         
-        if not os.path.exists(stl_file_path):
-            # Log all files in the directory to help debug
-            logging.error(f"File not found: {stl_file_path}")
-            try:
-                dir_contents = os.listdir(MODELS_DIR)
-                logging.info(f"Files in models directory: {dir_contents}")
-                # Also list all subdirectories
-                for dir_path in os.listdir(MODELS_DIR):
-                    full_path = os.path.join(MODELS_DIR, dir_path)
-                    if os.path.isdir(full_path):
-                        sub_contents = os.listdir(full_path)
-                        logging.info(f"Files in subdirectory {dir_path}: {sub_contents}")
-            except Exception as e:
-                logging.error(f"Error listing directory contents: {str(e)}")
-            return {"error": "File not found"}, 404
+        # Check if the file is in our cache
+        stl_file_path = _cache_get(filename)
+        if stl_file_path is None or not os.path.exists(stl_file_path):
+            # Rendered models live at MODELS_DIR/<model_id>/<model_id>.stl, so build the
+            # path directly when the index doesn't know about the file
+            stl_file_path = _model_stl_path(model_id)
+            if not os.path.exists(stl_file_path):
+                logging.error(f"File not found: {filename}")
+                return {"error": "File not found"}, 404
+            
+            # Remember where the file was found for the next request
+            logging.debug("Found file in models directory: %s", stl_file_path)
+            _cache_put(filename, stl_file_path)
             
         try:
-            # Log file details
-            file_size = os.path.getsize(stl_file_path)
-            logging.info(f"Serving STL file: {stl_file_path}, size: {file_size} bytes")
+            # Log file details; skip the stat call unless debug logging is on
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("Serving STL file: %s, size: %d bytes", stl_file_path, os.path.getsize(stl_file_path))
             
-            # Set proper MIME type and headers for STL files
-            @after_this_request
-            def add_header(response):
-                response.headers['Access-Control-Allow-Origin'] = '*'
-                response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-                response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-                response.headers['Content-Type'] = 'model/stl'
+            # Let the reverse proxy stream the file itself when configured to
+            if STL_ACCEL_REDIRECT_PREFIX:
+                relative_path = os.path.relpath(stl_file_path, MODELS_DIR).replace(os.sep, '/')
+                response = make_response('')
+                response.headers['X-Accel-Redirect'] = f"{STL_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{relative_path}"
                 return response
-                
-            # Return the STL file for display
-            return send_file(stl_file_path, 
-                             mimetype='model/stl',
-                             as_attachment=False)
+            
+            # Return the STL file for display, answering revalidations with 304; the
+            # model id is a content hash, so it doubles as a stable ETag
+            return send_from_directory(os.path.dirname(stl_file_path),
+                                       os.path.basename(stl_file_path),
+                                       mimetype='model/stl',
+                                       as_attachment=False,
+                                       conditional=True,
+                                       etag=model_id,
+                                       last_modified=os.path.getmtime(stl_file_path))
         except Exception as e:
             logging.error(f"Error serving STL file: {str(e)}")
             return {"error": f"Error serving STL file: {str(e)}"}, 500
@@ -286,12 +626,20 @@ class UploadLibrary(Resource):
             
         if not file.filename.endswith('.scad'):
             return {"error": "Only .scad files are allowed"}, 400
+        
+        # Only accept names that are already safe, so nothing can escape LIBRARIES_DIR
+        # and include statements keep working with the name the user uploaded
+        filename = secure_filename(file.filename)
+        if not filename.endswith('.scad') or filename != file.filename.replace('\\', '/').rsplit('/', 1)[-1]:
+            return {"error": "Invalid library file name"}, 400
             
         try:
             # Save the library file
-            filename = file.filename
             file_path = os.path.join(LIBRARIES_DIR, filename)
-            file.save(file_path)
+            tmp_file_path = f"{file_path}.{secrets.token_hex(16)}.upload"
+            file.save(tmp_file_path)
+            os.replace(tmp_file_path, file_path)
+            _LIB_CACHE['files'] = None
             logging.info(f"Uploaded library file: {filename}")
             
             return {"success": True, "message": f"Library file {filename} uploaded successfully"}
@@ -299,12 +647,27 @@ class UploadLibrary(Resource):
             logging.error(f"Error uploading library file: {str(e)}")
             return {"error": f"Error uploading library file: {str(e)}"}, 500
 
+@app.after_request
+def add_stl_headers(response):
+    """Set proper MIME type and CORS headers on STL files served by /api/view3d."""
+    if (request.path == '/api/view3d' and request.method in ('GET', 'HEAD')
+            and response.status_code in (200, 304)):
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
+        response.headers['Content-Type'] = 'model/stl'
+        # STL names are content hashes, so a given URL always serves the same bytes
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 # Register routes
 api.add_resource(HelloWorld, '/api/hello')
 api.add_resource(RenderScad, '/api/render')
 api.add_resource(GetStl, '/api/getstl')
+api.add_resource(RenderParallel, '/api/render_parallel')
 api.add_resource(View3D, '/api/view3d')
 api.add_resource(UploadLibrary, '/api/upload-library')
 
 if __name__ == "__main__":
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Local development only; production runs under Gunicorn (see gunicorn.conf.py)
+    app.run(host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
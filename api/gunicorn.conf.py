@@ -0,0 +1,36 @@
+"""Gunicorn configuration for serving the OpenSCAD API in production."""
+import os
+import shutil
+import subprocess
+import tempfile
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+
+# Pre-fork several workers so renders and STL downloads proceed in parallel
+workers = int(os.environ.get("GUNICORN_WORKERS", 2 * (os.cpu_count() or 1) + 1))
+
+# gevent workers yield while waiting on OpenSCAD subprocesses and file streaming,
+# so one long render does not block other requests handled by the same worker
+worker_class = "gevent"
+worker_connections = 1000
+
+accesslog = "-"
+
+
+def on_starting(server):
+    """Run one throwaway render so the OpenSCAD binary and font cache are warm before serving."""
+    openscad_path = shutil.which("openscad") or "/usr/local/bin/openscad"
+    with tempfile.TemporaryDirectory() as warmup_dir:
+        scad_file_path = os.path.join(warmup_dir, "warmup.scad")
+        with open(scad_file_path, "w", encoding="utf-8") as scad_file:
+            scad_file.write('cube(1);\nlinear_extrude(1) text("OpenSCAD");\n')
+        try:
+            subprocess.run(
+                [openscad_path, "-o", os.path.join(warmup_dir, "warmup.stl"), scad_file_path],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=120,
+            )
+            server.log.info("OpenSCAD warm-up render finished")
+        except (OSError, subprocess.TimeoutExpired) as e:
+            server.log.warning(f"OpenSCAD warm-up render failed: {e}")
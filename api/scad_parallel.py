@@ -0,0 +1,185 @@
+"""
+Helpers for rendering a top-level OpenSCAD union() in parallel.
+
+The union is split into one program per child, each child is rendered by its own
+OpenSCAD process, and the resulting binary STL files are merged back into one.
+"""
+import os
+import re
+import shutil
+import struct
+
+# Statements that never produce geometry on their own
+_LIBRARY_STATEMENT = re.compile(r'(?:include|use)\s*<[^>\n]*>')
+_DEFINITION_STATEMENT = re.compile(r'(?:module|function)\b|\$?[A-Za-z_]\w*\s*=(?!=)')
+_UNION_STATEMENT = re.compile(r'union\s*\(\s*\)\s*\{(.*)\}\s*$', re.DOTALL)
+_ELSE_KEYWORD = re.compile(r'else\b')
+
+# Children that change the meaning of the union when rendered on their own:
+# echo()/assert() wrappers and the disable, background and root modifiers
+_UNSPLITTABLE_CHILD = re.compile(r'(?:echo|assert)\s*\(|[*%!]')
+# A root modifier anywhere in the program replaces the whole tree being rendered
+_ROOT_MODIFIER = re.compile(r'(?:^|[;{})])\s*!(?!=)')
+_COMMENT_OR_STRING = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\])*"', re.DOTALL)
+
+def _skip_trivia(source, i):
+    """Return the index of the next character in source that is not whitespace or a comment."""
+    while i < len(source):
+        if source[i].isspace():
+            i += 1
+        elif source.startswith('//', i):
+            newline = source.find('\n', i)
+            i = len(source) if newline == -1 else newline + 1
+        elif source.startswith('/*', i):
+            comment_end = source.find('*/', i + 2)
+            i = len(source) if comment_end == -1 else comment_end + 2
+        else:
+            break
+    return i
+
+def split_statements(source):
+    """
+    Split OpenSCAD source into top-level statements.
+
+    An if statement and its else branch form a single statement, whether or not
+    the branches are braced.
+
+    Returns:
+    A list of (start, end) spans into source, or None if the source cannot be split
+    (unbalanced brackets, unterminated strings or comments, or a trailing partial statement).
+    """
+    spans = []
+    depth = 0
+    start = None
+    i = 0
+    while True:
+        if start is None:
+            i = _skip_trivia(source, i)
+            if i >= len(source):
+                break
+            if source[i] == ';':
+                i += 1
+                continue
+            start = i
+            # include <...> and use <...> end at the closing angle bracket
+            match = _LIBRARY_STATEMENT.match(source, i)
+            if match:
+                spans.append((start, match.end()))
+                start = None
+                i = match.end()
+                continue
+        elif i >= len(source):
+            return None
+
+        char = source[i]
+        if source.startswith('//', i) or source.startswith('/*', i):
+            i = _skip_trivia(source, i)
+            continue
+        if char == '"':
+            i += 1
+            while i < len(source) and source[i] != '"':
+                i += 2 if source[i] == '\\' else 1
+            if i >= len(source):
+                return None
+        elif char in '([{':
+            depth += 1
+        elif char in ')]}':
+            depth -= 1
+            if depth < 0:
+                return None
+            # A block closing at the top level ends the statement unless an else follows
+            if char == '}' and depth == 0 and not _ELSE_KEYWORD.match(source, _skip_trivia(source, i + 1)):
+                spans.append((start, i + 1))
+                start = None
+        elif char == ';' and depth == 0:
+            # Likewise for a braceless branch such as "if (a) cube(1); else sphere(1);"
+            if not _ELSE_KEYWORD.match(source, _skip_trivia(source, i + 1)):
+                spans.append((start, i + 1))
+                start = None
+        i += 1
+    return spans
+
+def _is_definition(statement):
+    """Return True if a statement only defines modules, functions, variables or imports."""
+    return bool(_LIBRARY_STATEMENT.match(statement) or _DEFINITION_STATEMENT.match(statement))
+
+def split_union_children(scad_code):
+    """
+    Split code whose only geometry is a top-level union() into one program per child.
+
+    Each generated program keeps the code around the union unchanged and wraps its child
+    in a union() of its own, together with the definitions from the union body, so
+    variables and modules keep the scope they had in the original union.
+
+    Returns:
+    A list of SCAD sources, or None if the code does not have that shape, the union
+    has fewer than two children, or a child is not a plain geometry statement.
+    """
+    if _ROOT_MODIFIER.search(_COMMENT_OR_STRING.sub(' ', scad_code)):
+        return None
+
+    spans = split_statements(scad_code)
+    if spans is None:
+        return None
+
+    geometry = [span for span in spans if not _is_definition(scad_code[span[0]:span[1]])]
+    if len(geometry) != 1:
+        return None
+    start, end = geometry[0]
+    match = _UNION_STATEMENT.match(scad_code, start, end)
+    if not match:
+        return None
+
+    body = match.group(1)
+    body_spans = split_statements(body)
+    if body_spans is None:
+        return None
+    shared, children = [], []
+    for body_start, body_end in body_spans:
+        statement = body[body_start:body_end]
+        if _is_definition(statement):
+            shared.append(statement)
+        elif _UNSPLITTABLE_CHILD.match(statement):
+            return None
+        else:
+            children.append(statement)
+    if len(children) < 2:
+        return None
+
+    prefix = scad_code[:start]
+    suffix = scad_code[end:]
+    definitions = ''.join(f"{statement}\n" for statement in shared)
+    return [f"{prefix}union() {{\n{definitions}{child}\n}}{suffix}" for child in children]
+
+# Binary STL layout: 80-byte header, uint32 triangle count, then 50 bytes per triangle
+_STL_HEADER_SIZE = 80
+_STL_TRIANGLE_SIZE = 50
+
+def merge_binary_stls(stl_paths, out_path):
+    """
+    Concatenate binary STL files into one by summing their triangle counts.
+
+    No Boolean union is performed, so the merged mesh is only exact when the parts
+    do not overlap.
+
+    Raises:
+    ValueError if an input is not a well-formed binary STL file.
+    """
+    total_triangles = 0
+    with open(out_path, 'wb') as out_file:
+        out_file.write(b'\0' * (_STL_HEADER_SIZE + 4))
+        for stl_path in stl_paths:
+            with open(stl_path, 'rb') as stl_file:
+                header = stl_file.read(_STL_HEADER_SIZE + 4)
+                if len(header) < _STL_HEADER_SIZE + 4:
+                    raise ValueError(f"Truncated binary STL file: {stl_path}")
+                (triangles,) = struct.unpack('<I', header[_STL_HEADER_SIZE:])
+                if os.path.getsize(stl_path) != len(header) + triangles * _STL_TRIANGLE_SIZE:
+                    raise ValueError(f"Malformed binary STL file: {stl_path}")
+                shutil.copyfileobj(stl_file, out_file)
+                total_triangles += triangles
+
+        # Binary STL headers must not begin with "solid", which marks ASCII STL
+        out_file.seek(0)
+        out_file.write(b'OpenSCAD merged model'.ljust(_STL_HEADER_SIZE, b' '))
+        out_file.write(struct.pack('<I', total_triangles))
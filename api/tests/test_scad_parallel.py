@@ -0,0 +1,185 @@
+"""
+Tests for the union splitter and binary STL merge used by /api/render_parallel.
+
+Run from the api directory with: python -m unittest discover tests
+"""
+import os
+import struct
+import tempfile
+import unittest
+
+from scad_parallel import merge_binary_stls, split_statements, split_union_children
+
+def _statements(source):
+    """Return the text of each top-level statement in source."""
+    return [source[start:end] for start, end in split_statements(source)]
+
+def _write_stl(path, triangles, header=b'test'):
+    """Write a binary STL file with the given number of distinguishable triangles."""
+    with open(path, 'wb') as stl_file:
+        stl_file.write(header.ljust(80, b'\0'))
+        stl_file.write(struct.pack('<I', triangles))
+        for index in range(triangles):
+            stl_file.write(struct.pack('<12fH', *([float(index)] * 12), 0))
+
+class SplitStatementsTest(unittest.TestCase):
+    def test_simple_statements(self):
+        self.assertEqual(_statements("cube(1);\nsphere(2);"), ["cube(1);", "sphere(2);"])
+
+    def test_block_statement_ends_at_closing_brace(self):
+        self.assertEqual(
+            _statements("translate([1,0,0]) { cube(1); sphere(1); } cylinder(1);"),
+            ["translate([1,0,0]) { cube(1); sphere(1); }", "cylinder(1);"])
+
+    def test_braced_if_else_is_one_statement(self):
+        source = "if (a) { cube(1); } else { sphere(1); } cylinder(1);"
+        self.assertEqual(
+            _statements(source),
+            ["if (a) { cube(1); } else { sphere(1); }", "cylinder(1);"])
+
+    def test_braceless_if_else_is_one_statement(self):
+        source = "if (a) cube(1); else sphere(1);\ncylinder(1);"
+        self.assertEqual(_statements(source), ["if (a) cube(1); else sphere(1);", "cylinder(1);"])
+
+    def test_else_if_chain_is_one_statement(self):
+        source = "if (a) cube(1); else if (b) { sphere(1); } else cylinder(1);"
+        self.assertEqual(_statements(source), [source])
+
+    def test_else_prefixed_identifier_is_not_a_continuation(self):
+        self.assertEqual(_statements("cube(1); elsewhere();"), ["cube(1);", "elsewhere();"])
+
+    def test_include_and_use(self):
+        self.assertEqual(
+            _statements("include <a/b.scad>\nuse <c.scad>;\ncube(1);"),
+            ["include <a/b.scad>", "use <c.scad>", "cube(1);"])
+
+    def test_comments_and_strings_are_not_split(self):
+        source = 'text("a;b}"); // c; }\n/* d; { */ cube(1);'
+        self.assertEqual(_statements(source), ['text("a;b}");', "cube(1);"])
+
+    def test_escaped_quote_in_string(self):
+        self.assertEqual(_statements(r'text("a\";"); cube(1);'), [r'text("a\";");', "cube(1);"])
+
+    def test_invalid_source_returns_none(self):
+        for source in ["cube(1", "cube(1));", 'text("a);', "cube(1)", "{ cube(1);"]:
+            with self.subTest(source=source):
+                self.assertIsNone(split_statements(source))
+
+class SplitUnionChildrenTest(unittest.TestCase):
+    def test_children_keep_surrounding_definitions(self):
+        source = (
+            "include <lib.scad>\n"
+            "size = 2;\n"
+            "module part() { cube(size); }\n"
+            "union() {\n"
+            "  offset = 3;\n"
+            "  part();\n"
+            "  translate([offset, 0, 0]) sphere(size);\n"
+            "}\n")
+        children = split_union_children(source)
+        self.assertEqual(len(children), 2)
+        for child, geometry in zip(children, ["part();", "translate([offset, 0, 0]) sphere(size);"]):
+            self.assertIn("include <lib.scad>", child)
+            self.assertIn("module part() { cube(size); }", child)
+            self.assertIn("offset = 3;", child)
+            self.assertIn(geometry, child)
+        self.assertNotIn("sphere", children[0])
+        self.assertNotIn("part();", children[1])
+
+    def test_body_definitions_keep_union_scope(self):
+        # OpenSCAD uses the last assignment in a scope, so x must stay inside the union
+        children = split_union_children("union(){ x=1; cube(x); sphere(x); } x=2;")
+        self.assertEqual(children, [
+            "union() {\nx=1;\ncube(x);\n} x=2;",
+            "union() {\nx=1;\nsphere(x);\n} x=2;",
+        ])
+
+    def test_braceless_if_else_child_stays_whole(self):
+        children = split_union_children("union() { if (a) cube(1); else sphere(1); cylinder(1); }")
+        self.assertEqual(len(children), 2)
+        self.assertIn("if (a) cube(1); else sphere(1);", children[0])
+        self.assertNotIn("cylinder", children[0])
+
+    def test_not_a_single_top_level_union(self):
+        for source in [
+            "cube(1); sphere(1);",
+            "difference() { cube(1); sphere(1); }",
+            "union() { cube(1); sphere(1); } cylinder(1);",
+            "union() { cube(1); }",
+            "union() { cube(1); sphere(1);",
+        ]:
+            with self.subTest(source=source):
+                self.assertIsNone(split_union_children(source))
+
+    def test_unsplittable_children(self):
+        for child in [
+            'echo("x") cube(1);',
+            "assert(true) cube(1);",
+            "*cube(1);",
+            "%cube(1);",
+            "!cube(1);",
+        ]:
+            with self.subTest(child=child):
+                self.assertIsNone(split_union_children(f"union() {{ {child} sphere(1); }}"))
+
+    def test_root_modifier_anywhere_disables_split(self):
+        for source in [
+            "module part() { !cube(1); }\nunion() { part(); sphere(1); }",
+            "union() { translate([1,0,0]) !cube(1); sphere(1); }",
+            "union() { rotate(1) { !cube(1); } sphere(1); }",
+        ]:
+            with self.subTest(source=source):
+                self.assertIsNone(split_union_children(source))
+
+    def test_negation_is_not_a_root_modifier(self):
+        source = '// !cube(1);\nflag = !false;\nunion() { if (!flag && 1 != 2) cube(1); text("!"); }'
+        self.assertEqual(len(split_union_children(source)), 2)
+
+class MergeBinaryStlsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def _path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def test_merge_sums_triangles_in_order(self):
+        _write_stl(self._path("a.stl"), 2)
+        _write_stl(self._path("b.stl"), 3)
+        merge_binary_stls([self._path("a.stl"), self._path("b.stl")], self._path("out.stl"))
+
+        with open(self._path("out.stl"), 'rb') as out_file:
+            merged = out_file.read()
+        self.assertEqual(len(merged), 84 + 5 * 50)
+        self.assertEqual(struct.unpack('<I', merged[80:84])[0], 5)
+        self.assertFalse(merged[:80].startswith(b'solid'))
+        first_floats = [struct.unpack('<f', merged[84 + i * 50:88 + i * 50])[0] for i in range(5)]
+        self.assertEqual(first_floats, [0.0, 1.0, 0.0, 1.0, 2.0])
+
+    def test_empty_inputs(self):
+        _write_stl(self._path("a.stl"), 0)
+        merge_binary_stls([self._path("a.stl")], self._path("out.stl"))
+        self.assertEqual(os.path.getsize(self._path("out.stl")), 84)
+
+    def test_ascii_header_is_replaced(self):
+        _write_stl(self._path("a.stl"), 1, header=b'solid OpenSCAD_Model')
+        merge_binary_stls([self._path("a.stl")], self._path("out.stl"))
+        with open(self._path("out.stl"), 'rb') as out_file:
+            self.assertFalse(out_file.read(80).startswith(b'solid'))
+
+    def test_truncated_file_raises(self):
+        with open(self._path("short.stl"), 'wb') as stl_file:
+            stl_file.write(b'\0' * 40)
+        with self.assertRaises(ValueError):
+            merge_binary_stls([self._path("short.stl")], self._path("out.stl"))
+
+    def test_triangle_count_mismatch_raises(self):
+        _write_stl(self._path("a.stl"), 2)
+        with open(self._path("a.stl"), 'r+b') as stl_file:
+            stl_file.seek(80)
+            stl_file.write(struct.pack('<I', 3))
+        with self.assertRaises(ValueError):
+            merge_binary_stls([self._path("a.stl")], self._path("out.stl"))
+
+if __name__ == '__main__':
+    unittest.main()